@@ -0,0 +1,420 @@
+# ======================================================
+# WEATHER_CORE
+# ------------------------------------------------------
+# Gemensam kod för väderstationerna: vind från Arduino,
+# temperatur från DS18B20, publicering via MQTT.
+# Varje Pi har ett eget startskript som anropar run()
+# med sina broker-inställningar och sitt topic.
+# ======================================================
+import array, asyncio, fcntl, json, os, re, sys, termios, time
+import serial_asyncio, paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# ======================================================
+# FUNKTION: Hitta första enhet i en katalog
+# ------------------------------------------------------
+# - Går igenom katalogen med os.scandir och stannar vid
+#   första namn som börjar med något av prefixen.
+# - Returnerar sökvägen (+ suffix), annars FileNotFoundError.
+# ======================================================
+def find_first(path, prefixes, suffix=""):
+    with os.scandir(path) as it:
+        for e in it:
+            if e.name.startswith(prefixes):
+                return e.path + suffix
+    raise FileNotFoundError(f"ingen {prefixes} i {path}")
+
+
+# ======================================================
+# KONFIGURATION
+# ------------------------------------------------------
+# Gemensam för alla Pi (broker och topic ges till run()).
+# - SER_DIR/SER_PREFIX : Arduino-port, första som hittas
+#                        (ex. /dev/ttyACM0, /dev/ttyUSB0)
+# - SER_BAUD   : Baudrate, måste matcha Arduino-koden
+# - SER_RETRY  : Sekunder innan serieporten öppnas igen efter fel
+# - W1_DIR     : 1-Wire-enheter, första DS18B20 (28-*) används
+# - TEMP_RES   : Upplösning i bitar (9 bit ≈ 94 ms konvertering)
+# - TEMP_PERIOD: Sekunder mellan temperaturavläsningar
+# - PUB_PERIOD : Sekunder mellan MQTT-meddelanden
+# - WIND_MAX_AGE: Äldre vindvärde än så publiceras som null
+# - MQTT_POLL  : Sekunder mellan MQTT-underhåll (keepalive/återanslut)
+# - MQTT_SESSION: Sekunder brokern sparar sessionen efter frånkoppling
+# - WS_RE      : Snabbtolkning av Arduinos {"ws_ms": x}-rad
+# - CPU_CORE   : Kärna processen låses till (isolcpus=3 i cmdline.txt)
+# - RT_PRIO    : SCHED_FIFO-prioritet för event-loopen
+# ======================================================
+SER_DIR, SER_PREFIX = "/dev", ("ttyACM", "ttyUSB")
+SER_BAUD = 115200
+SER_RETRY = 5.0
+W1_DIR = "/sys/bus/w1/devices"
+TEMP_RES = 9
+TEMP_PERIOD = 1.0
+PUB_PERIOD = 1.0
+WIND_MAX_AGE = 2 * PUB_PERIOD
+MQTT_POLL = 0.5
+MQTT_SESSION = 3600
+WS_RE = re.compile(rb'"ws_ms"\s*:\s*([-+0-9.eE]+)')
+CPU_CORE, RT_PRIO = 3, 50
+
+
+# ======================================================
+# FUNKTION: Läs temperatur från DS18B20
+# ------------------------------------------------------
+# - fd: w1_slave, öppnad av open_temp().
+# - Läser sensorfilen från början (ett pread-anrop).
+#   mmap går inte: sysfs-textfiler ger ENODEV, och varje
+#   ny mätning skapas först när filen läses från offset 0
+#   (eller tas från en startad bulk-konvertering, se nedan).
+# - Kontroll: rad 1 måste innehålla "YES" (CRC OK).
+# - Rad 2 innehåller temperatur i milligrader efter "t=".
+# - Returnerar temperatur i °C (float) eller None om fel.
+# ======================================================
+def read_temp(fd):
+    buf = os.pread(fd, 128, 0)
+    if b"YES" in buf[:buf.find(b"\n")]:
+        return int(buf[buf.rfind(b"t=") + 2:]) / 1000
+    return None
+
+
+# ======================================================
+# FUNKTION: Tolka vindrad från Arduino
+# ------------------------------------------------------
+# - Värdet plockas ur raden (bytes) med WS_RE, json.loads
+#   används bara som reserv om raden ser annorlunda ut.
+# - Returnerar vindhastighet i m/s (float) eller None.
+# ======================================================
+def parse_ws(line):
+    m = WS_RE.search(line)
+    try:
+        return float(m.group(1) if m else json.loads(line).get("ws_ms"))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+# ======================================================
+# FUNKTION: Formatera MQTT-meddelande
+# ------------------------------------------------------
+# - Bygger {"ws_ms": .., "temp_c": ..} direkt som bytes
+#   med %-formatering, 2 decimaler (null om värdet är okänt).
+# - Bytes går rakt in i paho utan str→bytes-konvertering.
+# ======================================================
+def format_combined(ws, tc):
+    ws_b = b"null" if ws is None else b"%.2f" % ws
+    tc_b = b"null" if tc is None else b"%.2f" % tc
+    return b'{"ws_ms":%s,"temp_c":%s}' % (ws_b, tc_b)
+
+
+# ======================================================
+# FUNKTION: Sätt upplösning på DS18B20
+# ------------------------------------------------------
+# - Skriver till w1_therm:s "resolution" bredvid w1_slave.
+# - Lägre upplösning → kortare 1-Wire-konvertering
+#   (12 bit ≈ 750 ms, 9 bit ≈ 94 ms, 0.5 °C steg).
+# - Kräver root och nyare kärna; annars behålls 12 bit.
+# ======================================================
+def set_temp_resolution(temp_file, bits):
+    try:
+        with open(os.path.join(os.path.dirname(temp_file), "resolution"), "w") as f:
+            f.write(str(bits))
+    except OSError:
+        pass
+
+
+# ======================================================
+# FUNKTION: Hitta therm_bulk_read för sensorns buss
+# ------------------------------------------------------
+# - Filen ligger hos bussmastern (w1_bus_master*), en nivå
+#   ovanför sensorns katalog.
+# - Returnerar sökvägen, eller None om kärnan saknar den
+#   eller vi inte får skriva (då läses w1_slave som vanligt).
+# ======================================================
+def find_bulk_read(temp_file):
+    master = os.path.dirname(os.path.dirname(os.path.realpath(temp_file)))
+    path = os.path.join(master, "therm_bulk_read")
+    return path if os.access(path, os.W_OK) else None
+
+
+# ======================================================
+# FUNKTION: Öppna DS18B20
+# ------------------------------------------------------
+# - Hittar första sensorn (28-*), öppnar w1_slave och sänker
+#   upplösningen (TEMP_RES).
+# - Körs vid start och efter läsfel, så en sensor som
+#   försvunnit och kommit tillbaka (ny kernfs-nod) hittas igen.
+# - Returnerar (fd, therm_bulk_read-sökväg eller None).
+# ======================================================
+def open_temp():
+    temp_file = find_first(W1_DIR, "28-", "/w1_slave")
+    fd = os.open(temp_file, os.O_RDONLY)
+    set_temp_resolution(temp_file, TEMP_RES)
+    return fd, find_bulk_read(temp_file)
+
+
+# ======================================================
+# FUNKTION: Starta temperaturkonvertering
+# ------------------------------------------------------
+# - Skriver "trigger" till therm_bulk_read: alla sensorer
+#   på bussen börjar konvertera och anropet väntar inte.
+# - Nästa läsning av w1_slave ger då resultatet utan att
+#   starta (och vänta på) en egen konvertering.
+# ======================================================
+def trigger_conversion(bulk_file):
+    try:
+        with open(bulk_file, "w") as f:
+            f.write("trigger\n")
+    except OSError:
+        pass
+
+
+# ======================================================
+# FUNKTION: Realtidsschemaläggning
+# ------------------------------------------------------
+# - Låser processen till en kärna → ingen flytt mellan
+#   kärnor mitt i en läsning.
+# - SCHED_FIFO för event-loopen (serieläsningen) kräver
+#   CAP_SYS_NICE: setcap cap_sys_nice+ep $(which python3)
+# - Saknas kärnan eller rättigheten körs vi vidare ändå.
+# ======================================================
+def set_realtime(core, prio):
+    try:
+        os.sched_setaffinity(0, {core})
+    except OSError:
+        pass
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(prio))
+    except OSError:
+        pass
+
+
+# ======================================================
+# FUNKTION: Låg latens på serieporten
+# ------------------------------------------------------
+# - Sätter ASYNC_LOW_LATENCY så att drivrutinen skickar
+#   vidare data direkt istället för var 16:e ms.
+# - pyserial >= 3.5 har set_low_latency_mode(), annars
+#   görs samma ioctl (TIOCGSERIAL/TIOCSSERIAL) för hand.
+# - Stöder inte drivrutinen flaggan körs vi vidare ändå.
+# ======================================================
+ASYNC_LOW_LATENCY = 0x2000
+
+
+def set_low_latency(ser):
+    try:
+        ser.set_low_latency_mode(True)
+    except AttributeError:
+        buf = array.array("i", [0] * 32)
+        try:
+            fcntl.ioctl(ser.fileno(), termios.TIOCGSERIAL, buf)
+            buf[4] |= ASYNC_LOW_LATENCY
+            fcntl.ioctl(ser.fileno(), termios.TIOCSSERIAL, buf)
+        except OSError:
+            pass
+    except ValueError:
+        pass
+
+
+# ======================================================
+# KORUTIN: Vinddata från Arduino
+# ------------------------------------------------------
+# - Hittar och öppnar Arduinons serieport (låg latens).
+# - Väntar (utan att blockera) på nästa rad från serieporten.
+# - Transporten läser hela block från porten och
+#   StreamReader delar upp raderna, ingen läsning byte för byte.
+# - Raden tolkas med parse_ws().
+# - Giltigt värde → senaste vindvärdet sparas i state,
+#   tillsammans med tidpunkten (time.monotonic()).
+# - Serieporten rensas aldrig; hinner flera rader komma in
+#   skriver de bara över varandra, publiceraren tar senaste.
+# - Fel på porten (urdragen USB, EOF, skräp) → vindvärdet
+#   nollställs och porten öppnas igen efter SER_RETRY s.
+#   Temperatur och MQTT fortsätter under tiden.
+# ======================================================
+async def serial_loop(state):
+    while True:
+        writer = None
+        try:
+            reader, writer = await serial_asyncio.open_serial_connection(
+                url=find_first(SER_DIR, SER_PREFIX), baudrate=SER_BAUD)
+            set_low_latency(writer.transport.serial)
+            while True:
+                wind = parse_ws(await reader.readuntil(b"\n"))
+                if wind is not None:
+                    state["wind"] = wind
+                    state["wind_t"] = time.monotonic()
+        except (OSError, EOFError, asyncio.LimitOverrunError):
+            state["wind"] = None
+            if writer is not None:
+                writer.close()
+            await asyncio.sleep(SER_RETRY)
+
+
+# ======================================================
+# KORUTIN: Temperatur (1 ggr/s)
+# ------------------------------------------------------
+# - read_temp() gör blockerande fil-I/O → körs i en
+#   tråd via run_in_executor så att event-loopen är fri.
+# - Med therm_bulk_read: starta nästa konvertering direkt
+#   efter läsningen, så är den klar TEMP_PERIOD senare och
+#   läsningen behöver inte vänta på 1-Wire-bussen.
+# - Nästa läsning styrs av en deadline på time.monotonic()
+#   så att takten inte glider (och inte påverkas av NTP).
+# - Läsfel (sensorn borta, trasig t=-rad) → temperaturen
+#   nollställs, fd stängs och sensorn letas upp och öppnas
+#   igen nästa period. Vind och MQTT fortsätter under tiden.
+# ======================================================
+async def temp_loop(state):
+    loop = asyncio.get_running_loop()
+    next_temp = time.monotonic()
+    fd = bulk_file = None
+    while True:
+        try:
+            if fd is None:
+                fd, bulk_file = await loop.run_in_executor(None, open_temp)
+            state["temp"] = await loop.run_in_executor(None, read_temp, fd)
+        except (OSError, ValueError):
+            state["temp"] = None
+            if fd is not None:
+                os.close(fd)
+            fd = bulk_file = None
+        if bulk_file is not None:
+            await loop.run_in_executor(None, trigger_conversion, bulk_file)
+        now = time.monotonic()
+        next_temp = max(next_temp + TEMP_PERIOD, now)
+        await asyncio.sleep(next_temp - now)
+
+
+# ======================================================
+# KORUTIN: Publicera till MQTT
+# ------------------------------------------------------
+# - Ett meddelande per PUB_PERIOD (1 ggr/s), styrt av en
+#   deadline på time.monotonic() precis som temp_loop.
+# - Skickas så fort vind eller temperatur är känd, så
+#   temperaturen publiceras även om Arduinon tystnar.
+# - Vindvärde äldre än WIND_MAX_AGE skickas som null, så
+#   en hängd Arduino inte ger samma värde för evigt.
+# - MQTT: senaste vind + temperatur i ett meddelande som JSON
+#   (format_combined), samma Properties-objekt återanvänds.
+# - Socketen skrivs av event-loopen (se on_socket_*),
+#   ingen separat nätverkstråd.
+# - Debug: skriver ut samma JSON till terminalen.
+# ======================================================
+async def publish_loop(client, topic, props, state):
+    next_pub = time.monotonic()
+    while True:
+        wind, temp = state["wind"], state["temp"]
+        if time.monotonic() - state["wind_t"] > WIND_MAX_AGE:
+            wind = None
+        if wind is not None or temp is not None:
+            payload = format_combined(wind, temp)
+            client.publish(topic, payload, qos=0, retain=False, properties=props)
+            sys.stdout.buffer.write(payload + b"\n")
+
+        now = time.monotonic()
+        next_pub = max(next_pub + PUB_PERIOD, now)
+        await asyncio.sleep(next_pub - now)
+
+
+# ======================================================
+# CALLBACKS: MQTT-socket i event-loopen
+# ------------------------------------------------------
+# - userdata = asyncio-loopen (sätts i main()).
+# - Socketen registreras i loopens selector (epoll):
+#   läsbar → loop_read, skrivbar → loop_write.
+# - paho anropar dessa när socketen öppnas/stängs och när
+#   det finns data kvar att skicka.
+# - Återanslutning sker i en executor-tråd, så ändringarna
+#   lämnas över med call_soon_threadsafe (körs i ordning).
+#   fd hämtas direkt, socketen kan vara stängd när loopen
+#   hinner ta bort den.
+# ======================================================
+def on_socket_open(client, loop, sock):
+    loop.call_soon_threadsafe(loop.add_reader, sock.fileno(), client.loop_read)
+
+
+def on_socket_close(client, loop, sock):
+    loop.call_soon_threadsafe(loop.remove_reader, sock.fileno())
+
+
+def on_socket_register_write(client, loop, sock):
+    loop.call_soon_threadsafe(loop.add_writer, sock.fileno(), client.loop_write)
+
+
+def on_socket_unregister_write(client, loop, sock):
+    loop.call_soon_threadsafe(loop.remove_writer, sock.fileno())
+
+
+# ======================================================
+# KORUTIN: MQTT-underhåll
+# ------------------------------------------------------
+# - Ersätter loop_start(): läsning/skrivning sköts av
+#   on_socket_*, här görs bara keepalive (loop_misc).
+# - Ingen eller tappad anslutning → (åter)anslut i en
+#   executor-tråd så att event-loopen inte blockeras (paho
+#   väntar upp till 5 s per försök); misslyckas det provas
+#   igen vid nästa varv.
+# ======================================================
+async def mqtt_loop(client):
+    loop = asyncio.get_running_loop()
+    while True:
+        if client.socket() is None:
+            try:
+                await loop.run_in_executor(None, client.reconnect)
+            except OSError:
+                pass
+        else:
+            client.loop_misc()
+        await asyncio.sleep(MQTT_POLL)
+
+
+# ======================================================
+# HUVUDPROGRAM
+# ------------------------------------------------------
+# - Schemaläggning: CPU_CORE + SCHED_FIFO (RT_PRIO).
+# - MQTT: v5-klient med fast klient-id och kvarstående
+#   session (clean_start=False + SessionExpiryInterval,
+#   annars slänger brokern sessionen vid frånkoppling).
+#   Kö/in-flight-gränserna gäller bara QoS>0; vi skickar
+#   QoS 0, så de påverkar inte publiceringen idag.
+#   Nätverket drivs av event-loopen, inte av loop_start().
+#   connect_async ansluter inte direkt, första anslutningen
+#   görs av mqtt_loop (samma väg som återanslutning).
+# - Kör en korutin per källa i samma event-loop.
+# ======================================================
+async def main(topic, host, port, user, pw, client_id):
+    set_realtime(CPU_CORE, RT_PRIO)
+
+    client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5,
+                         userdata=asyncio.get_running_loop())
+    client.username_pw_set(user, pw)
+    client.max_inflight_messages_set(1)
+    client.max_queued_messages_set(1000)
+    client.on_socket_open = on_socket_open
+    client.on_socket_close = on_socket_close
+    client.on_socket_register_write = on_socket_register_write
+    client.on_socket_unregister_write = on_socket_unregister_write
+    conn_props = Properties(PacketTypes.CONNECT)
+    conn_props.SessionExpiryInterval = MQTT_SESSION
+    client.connect_async(host, port, 60, clean_start=False, properties=conn_props)
+    props = Properties(PacketTypes.PUBLISH)
+
+    state = {"wind": None, "wind_t": 0.0, "temp": None}
+    await asyncio.gather(
+        serial_loop(state),
+        temp_loop(state),
+        publish_loop(client, topic, props, state),
+        mqtt_loop(client),
+    )
+
+
+# ======================================================
+# FUNKTION: Starta väderstationen
+# ------------------------------------------------------
+# - topic     : MQTT topic för {"ws_ms": .., "temp_c": ..}
+# - host/port : MQTT-broker
+# - user/pw   : inloggning mot broker
+# - client_id : unikt per Pi (krävs för kvarstående session)
+# ======================================================
+def run(topic, host, port, user, pw, client_id):
+    asyncio.run(main(topic, host, port, user, pw, client_id))